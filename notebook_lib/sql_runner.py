@@ -2,6 +2,8 @@
 from __future__ import annotations
 
 import html as _html
+import re
+from collections import OrderedDict
 from pathlib import Path
 from typing import Callable, Optional, Tuple, Union, List, Any, Dict
 
@@ -10,12 +12,13 @@ import ipywidgets as widgets
 from IPython.display import display, clear_output, HTML
 
 from notebook_lib.sql_runner_store import (
-    append_history, load_latest_map, save_latest_map, load_scores, save_scores
+    append_history, load_latest_sql, save_latest_sql, load_scores, save_scores
 )
 
 from notebook_lib.sql_runner_ui_bits import (
     inject_css_once,
-    md_to_html,
+    render_md_block,
+    render_df_table,
     pick_success_title,
     render_score_badge,
     render_validation_banner,
@@ -41,6 +44,65 @@ def _detect_db_type(conn) -> str:
         "Supported: sqlite3, duckdb"
     )
 
+# Results beyond this many rows are not fetched for display; validators fetch the rest only
+# once the cheap checks pass (see validate_from_preview)
+MAX_DISPLAY_ROWS = 1000
+
+# (id(conn), data state, exact sql, fetch limit) -> (conn, df, table html) of recent SELECTs;
+# the sql is not whitespace-collapsed, which would also merge different string literals
+_RESULT_CACHE: "OrderedDict[tuple, Tuple[Any, pd.DataFrame, str]]" = OrderedDict()
+_RESULT_CACHE_SIZE = 8
+
+# SQL whose result can differ between two Runs on unchanged data; never cached
+_NONDETERMINISTIC_RE = re.compile(
+    r"\b(?:random|randomblob|changes|total_changes|last_insert_rowid|unixepoch)\s*\("
+    r"|\bcurrent_(?:timestamp|date|time)\b"
+    r"|'now'",
+    re.IGNORECASE,
+)
+
+def _normalize_sql(s: str) -> str:
+    return " ".join(s.split())
+
+def _is_select(q: str) -> bool:
+    # q is already stripped; only its first few characters matter
+    return q[:6].lower().startswith(("select", "with"))
+
+def _sqlite_data_state(conn) -> Optional[tuple]:
+    """
+    Changes whenever the data or schema behind `conn` may have changed:
+    writes on this connection, commits from other connections, DDL
+    (including TEMP tables/views, which live in their own schema).
+    """
+    try:
+        return (
+            conn.total_changes,
+            conn.execute("PRAGMA data_version").fetchone()[0],
+            conn.execute("PRAGMA schema_version").fetchone()[0],
+            conn.execute("PRAGMA temp.schema_version").fetchone()[0],
+        )
+    except Exception:
+        return None
+
+def _fetch_duckdb_limited(conn, query: str, limit: int) -> pd.DataFrame:
+    """
+    First `limit` rows of a DuckDB query. Chunks come out in vectors of up to
+    2048 rows but filtered scans leave them partly filled, so keep fetching
+    until there are enough rows or the result runs out.
+    """
+    res = conn.execute(query)
+    chunks, n = [], 0
+    while n < limit:
+        chunk = res.fetch_df_chunk(vectors_per_chunk=-(-(limit - n) // 2048))
+        if len(chunk) == 0:
+            break
+        chunks.append(chunk)
+        n += len(chunk)
+    if not chunks:
+        return chunk
+    df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+    return df.head(limit)
+
 def make_sql_runner(
     conn,
     runner_id: str,
@@ -65,11 +127,12 @@ def make_sql_runner(
 
     # ---------- persistence ----------
     LOG_ALL_FILE = Path("sql_query_log.csv")
-    LOG_LATEST_FILE = Path("sql_query_latest.csv")
+    LOG_LATEST_FILE = Path("sql_query_latest.csv")  # legacy store, imported once
+    STATE_DB_FILE = Path("sql_runner_state.db")
     SCORE_FILE = Path("sql_grades.csv")
 
-    latest_map = load_latest_map(LOG_LATEST_FILE)
-    last_saved = latest_map.get(runner_id)
+    last_saved = load_latest_sql(STATE_DB_FILE, runner_id, legacy_latest_file=LOG_LATEST_FILE)
+    last_saved_norm = _normalize_sql(last_saved or "")
     initial_sql = last_saved if last_saved is not None else (default_sql or "")
 
     # ---------- UI chrome (CSS) ----------
@@ -79,7 +142,7 @@ def make_sql_runner(
     desc_widget = None
     if description_md:
         desc_widget = widgets.HTML(
-            value=f"<div class='sql-desc'>{md_to_html(description_md)}</div>"
+            value=render_md_block(description_md, "sql-desc")
         )
 
     # Hint components
@@ -95,11 +158,13 @@ def make_sql_runner(
         )
         hint_visible = False
 
-        hint_html = widgets.HTML(value=f"<div class='sql-hintbox'>{md_to_html(hint_md)}</div>")
-        hint_box = widgets.Box([hint_html], layout=widgets.Layout(display="none"))
+        # filled on first reveal
+        hint_box = widgets.Box([], layout=widgets.Layout(display="none"))
 
         def on_hint_click(_):
             nonlocal hint_visible
+            if not hint_box.children:
+                hint_box.children = [widgets.HTML(value=render_md_block(hint_md, "sql-hintbox"))]
             hint_visible = not hint_visible
             hint_box.layout.display = "block" if hint_visible else "none"
 
@@ -119,28 +184,34 @@ def make_sql_runner(
         sol_btn.add_class("sql-sol-toggle")
         sol_visible = False
 
-        sol_close_btn = widgets.Button(
-            description="✕",
-            tooltip="Close",
-            layout=widgets.Layout(width="28px", height="28px"),
-        )
-        sol_close_btn.add_class("sql-sol-close")
+        # filled on first reveal
+        sol_box = widgets.Box([], layout=widgets.Layout(display="none"))
 
-        sol_title = widgets.HTML("<b>Solution</b>")
-        sol_header = widgets.HBox(
-            [sol_title, sol_close_btn],
-            layout=widgets.Layout(justify_content="space-between", align_items="center")
-        )
+        def _build_sol_inner():
+            sol_close_btn = widgets.Button(
+                description="✕",
+                tooltip="Close",
+                layout=widgets.Layout(width="28px", height="28px"),
+            )
+            sol_close_btn.add_class("sql-sol-close")
+            sol_close_btn.on_click(on_sol_close)
 
-        sol_body = widgets.HTML(value=f"<pre>{_html.escape(sol_sql)}</pre>")
+            sol_title = widgets.HTML("<b>Solution</b>")
+            sol_header = widgets.HBox(
+                [sol_title, sol_close_btn],
+                layout=widgets.Layout(justify_content="space-between", align_items="center")
+            )
 
-        sol_inner = widgets.VBox([sol_header, sol_body])
-        sol_inner.add_class("sql-solbox")
+            sol_body = widgets.HTML(value=f"<pre>{_html.escape(sol_sql)}</pre>")
 
-        sol_box = widgets.Box([sol_inner], layout=widgets.Layout(display="none"))
+            sol_inner = widgets.VBox([sol_header, sol_body])
+            sol_inner.add_class("sql-solbox")
+            return sol_inner
 
         def on_sol_click(_):
             nonlocal sol_visible
+            if not sol_box.children:
+                sol_box.children = [_build_sol_inner()]
             sol_visible = not sol_visible
             sol_box.layout.display = "block" if sol_visible else "none"
             sol_btn.description = "Hide solution" if sol_visible else "Show solution"
@@ -152,7 +223,6 @@ def make_sql_runner(
             sol_btn.description = "Show solution"
 
         sol_btn.on_click(on_sol_click)
-        sol_close_btn.on_click(on_sol_close)
 
     # ---------- validation banner ----------
     validation_widget = widgets.HTML(value="")
@@ -190,10 +260,10 @@ def make_sql_runner(
     box.add_class("sql-editor")
 
     results_out = widgets.Output()
-    schema_out = widgets.Output()
+    schema_out = None  # created when the schema tab is first opened
 
     results_box = widgets.Box([results_out], layout=widgets.Layout(width="100%", padding="8px"))
-    schema_box = widgets.Box([schema_out], layout=widgets.Layout(width="100%", padding="8px"))
+    schema_box = widgets.Box([], layout=widgets.Layout(width="100%", padding="8px"))
 
     tabs = widgets.Tab(children=[results_box, schema_box], layout=widgets.Layout(width="100%"))
     tabs.set_title(0, "Query results")
@@ -353,12 +423,22 @@ def make_sql_runner(
     toolbar.add_class("sql-toolbar")
 
     # ---------- database helpers ----------
-    def _run_select(query: str) -> pd.DataFrame:
+    def _run_select(query: str, limit: Optional[int] = None) -> pd.DataFrame:
         if db_type == "sqlite":
-            return pd.read_sql_query(query, conn)
-        return conn.execute(query).df()
+            if limit is None:
+                return pd.read_sql_query(query, conn)
+            chunks = pd.read_sql_query(query, conn, chunksize=limit)
+            try:
+                return next(chunks)
+            finally:
+                chunks.close()
+
+        if limit is None:
+            return conn.execute(query).df()
+        return _fetch_duckdb_limited(conn, query, limit)
     
     def _run_script(query: str) -> None:
+        _RESULT_CACHE.clear()
         if db_type == "sqlite":
             cur = conn.cursor()
             cur.executescript(query)
@@ -367,18 +447,6 @@ def make_sql_runner(
             conn.execute(query)
 
     def _list_tables() -> list[str]:
-        if db_type == "sqlite":
-            df = pd.read_sql_query(
-                """
-                SELECT name
-                FROM sqlite_master
-                WHERE type='table' AND name NOT LIKE 'sqlite_%'
-                ORDER BY name;
-                """,
-                conn
-            )
-            return df["name"].tolist()
-
         df = conn.execute(
             """
             SELECT table_name
@@ -391,18 +459,9 @@ def make_sql_runner(
         return df["table_name"].tolist()        
 
     def _table_info(table_name: str) -> pd.DataFrame:
-        if db_type == "sqlite":
-            info = pd.read_sql_query(f"PRAGMA table_info('{table_name}');", conn)
-            info = info[["name", "type", "notnull", "dflt_value", "pk"]]
-            return info.rename(columns={
-                "name": "attribute",
-                "type": "datatype",
-                "notnull": "not null",
-                "dflt_value": "default value",
-                "pk": "primary key"
-            })
-
-        info = conn.execute(f"DESCRIBE {table_name}").df()
+        # DESCRIBE takes no bound parameters, so quote the identifier instead
+        quoted = '"' + table_name.replace('"', '""') + '"'
+        info = conn.execute(f"DESCRIBE {quoted}").df()
         info = info.rename(columns={
             "column_name": "attribute",
             "column_type": "datatype",
@@ -431,12 +490,63 @@ def make_sql_runner(
 
         return info[["attribute", "datatype", "not null", "default value", "primary key"]]
 
+    def _schema_infos() -> Dict[str, pd.DataFrame]:
+        """Column info per table, ordered by table name."""
+        if db_type == "sqlite":
+            # one scan over every table's columns instead of one PRAGMA per table
+            df = pd.read_sql_query(
+                """
+                SELECT m.name AS tbl, p.name, p.type, p."notnull", p.dflt_value, p.pk
+                FROM sqlite_master AS m
+                JOIN pragma_table_info(m.name) AS p
+                WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'
+                ORDER BY m.name, p.cid;
+                """,
+                conn
+            )
+            df = df.rename(columns={
+                "name": "attribute",
+                "type": "datatype",
+                "notnull": "not null",
+                "dflt_value": "default value",
+                "pk": "primary key"
+            })
+            return {
+                tbl: group.drop(columns="tbl").reset_index(drop=True)
+                for tbl, group in df.groupby("tbl", sort=False)
+            }
+
+        return {t: _table_info(t) for t in _list_tables()}
+
+    def _schema_version() -> Optional[int]:
+        if db_type == "sqlite":
+            try:
+                return conn.execute("PRAGMA schema_version").fetchone()[0]
+            except Exception:
+                return None
+        return None
+
     # ---------- schema renderer ----------
+    schema_rendered_version = None
+
     def render_schema():
+        nonlocal schema_rendered_version, schema_out
+
+        if schema_out is None:
+            schema_out = widgets.Output()
+            schema_box.children = [schema_out]
+
+        # the schema tab is already showing this schema: nothing to redo
+        version = _schema_version()
+        if version is not None and version == schema_rendered_version:
+            return
+        schema_rendered_version = version
+
         with schema_out:
             clear_output()
             try:
-                all_tables = _list_tables()
+                infos = _schema_infos()
+                all_tables = list(infos)
 
                 if not all_tables:
                     display(HTML("<b>No tables found.</b>"))
@@ -463,11 +573,11 @@ def make_sql_runner(
                 titles = []
 
                 for t in tables:
-                    info = _table_info(t)
+                    info = infos[t]
 
                     out = widgets.Output()
                     with out:
-                        display(info.style.format(na_rep="NULL").hide(axis="index"))
+                        display(HTML(render_df_table(info)))
 
                     items.append(out)
                     titles.append(t)
@@ -480,6 +590,7 @@ def make_sql_runner(
                 display(acc)
 
             except Exception as e:
+                schema_rendered_version = None
                 display(HTML(f"<pre style='color:#b00020'>Error:\n{e}</pre>"))
 
     def on_tab_change(change):
@@ -490,7 +601,7 @@ def make_sql_runner(
 
     # ---------- actions ----------
     def run_query(_):
-        nonlocal last_saved, latest_map
+        nonlocal last_saved, last_saved_norm
 
         q = box.value.strip()
         with results_out:
@@ -502,17 +613,17 @@ def make_sql_runner(
                 set_status("No query to run.")
                 return
 
-            norm = lambda s: " ".join(s.split())
-            changed = (norm(q) != norm(last_saved or ""))
+            q_norm = _normalize_sql(q)
+            changed = (q_norm != last_saved_norm)
 
             if (not dedupe) or changed:
                 append_history(LOG_ALL_FILE, runner_id, q)
-                latest_map = load_latest_map(LOG_LATEST_FILE)
-                latest_map[runner_id] = q
-                save_latest_map(LOG_LATEST_FILE, latest_map)
+                save_latest_sql(STATE_DB_FILE, runner_id, q)
                 last_saved = q
+                last_saved_norm = q_norm
 
-            if select_only and not q.lower().lstrip().startswith(("select", "with")):
+            is_select = _is_select(q)
+            if select_only and not is_select:
                 display(HTML("<b>Only SELECT/WITH queries are allowed.</b>"))
                 tabs.selected_index = 0
                 set_status("Blocked: only SELECT/WITH allowed.")
@@ -528,13 +639,46 @@ def make_sql_runner(
                 sol_btn.disabled = True
 
             try:
-                if q.lower().lstrip().startswith(("select", "with")):
-                    df = _run_select(q)
-                    display(df.style.format(na_rep="NULL").hide(axis="index"))
-                    set_status(f"Returned {len(df)} row(s).")
+                if is_select:
+                    # repeated Runs of the same query on unchanged data reuse the last result
+                    state = _sqlite_data_state(conn) if db_type == "sqlite" else None
+                    # only what is shown is fetched; one extra row tells us there is more
+                    fetch_limit = MAX_DISPLAY_ROWS + 1
+                    cacheable = state is not None and not _NONDETERMINISTIC_RE.search(q_norm)
+                    cache_key = (id(conn), state, q, fetch_limit) if cacheable else None
+                    cached = _RESULT_CACHE.get(cache_key) if cache_key else None
+
+                    if cached is not None and cached[0] is conn:
+                        _RESULT_CACHE.move_to_end(cache_key)
+                        _, df, table_html = cached
+                    else:
+                        df = _run_select(q, limit=fetch_limit)
+                        table_html = render_df_table(df.head(MAX_DISPLAY_ROWS))
+                        if len(df) > MAX_DISPLAY_ROWS:
+                            table_html = (
+                                f"<div class='hint'>Showing the first {MAX_DISPLAY_ROWS} rows.</div>"
+                                + table_html
+                            )
+                        if cache_key:
+                            _RESULT_CACHE[cache_key] = (conn, df, table_html)
+                            while len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+                                _RESULT_CACHE.popitem(last=False)
+
+                    display(HTML(table_html))
+                    capped = len(df) > MAX_DISPLAY_ROWS
+                    if not capped:
+                        set_status(f"Returned {len(df)} row(s).")
+                    else:
+                        set_status(f"Returned more than {MAX_DISPLAY_ROWS} row(s); showing the first {MAX_DISPLAY_ROWS}.")
 
                     if validator:
-                        ok, problems = validator(q, df, conn)
+                        if not capped:
+                            ok, problems = validator(q, df, conn)
+                        elif hasattr(validator, "validate_from_preview"):
+                            # cheap column / row-count rejections before the full fetch
+                            ok, problems = validator.validate_from_preview(q, df, conn)
+                        else:
+                            ok, problems = validator(q, _run_select(q), conn)
                         show_validation(ok, problems)
                     else:
                         hide_validation()
@@ -562,9 +706,8 @@ def make_sql_runner(
                     sol_btn.disabled = False
 
     def revert_query(_):
-        nonlocal last_saved
-        latest_map_local = load_latest_map(LOG_LATEST_FILE)
-        saved = latest_map_local.get(runner_id)
+        # last_saved is kept in step with every save, so no store read is needed
+        saved = last_saved
         box.value = saved if saved is not None else (default_sql or "")
         set_status("Reverted to last saved." if saved is not None else "No saved query — reverted.")
 
@@ -600,7 +743,7 @@ def make_sql_runner(
             show_submit_result(ok=False, error="Please type a query first.")
             return
 
-        if select_only and not q.lower().lstrip().startswith(("select", "with")):
+        if select_only and not _is_select(q):
             show_submit_result(ok=False, error="Only SELECT/WITH queries are allowed.")
             return
 
@@ -697,5 +840,4 @@ def make_sql_runner(
     ui.add_class("sql-runner")
     display(ui)
 
-    render_schema()
     set_status(f"Ready ({db_type}).")
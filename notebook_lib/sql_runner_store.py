@@ -1,9 +1,12 @@
 # notebook_lib/sql_runner_store.py
 from __future__ import annotations
+import atexit
 import csv
+import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, TextIO, Tuple
 import html as _html
 
 def to_int(x):
@@ -12,13 +15,63 @@ def to_int(x):
     except Exception:
         return None
 
+HISTORY_HEADER = ["ts", "runner_id", "sql"]
+SCORES_HEADER = ["runner_id", "current_points", "max_points", "attempt"]
+
+# csv path -> (append handle, csv writer), opened once per kernel
+_APPENDERS: Dict[Path, Tuple[TextIO, Any]] = {}
+_appenders_lock = threading.Lock()
+
+def _appender(csv_file: Path, header: List[str]) -> Tuple[TextIO, Any]:
+    key = csv_file.resolve()
+    with _appenders_lock:
+        entry = _APPENDERS.get(key)
+        if entry is None:
+            f = csv_file.open("a", buffering=65536, newline="", encoding="utf-8")
+            w = csv.writer(f)
+            if f.tell() == 0:
+                w.writerow(header)
+            entry = _APPENDERS[key] = (f, w)
+    return entry
+
+# History rows are buffered and written in batches, off the Run click path
+HISTORY_FLUSH_SECONDS = 2.0
+HISTORY_FLUSH_ROWS = 50
+
+_history_lock = threading.Lock()
+_history_buf: Dict[Path, List[list]] = {}
+_history_buf_rows = 0
+_history_timer: Optional[threading.Timer] = None
+
+def flush_history() -> None:
+    global _history_buf, _history_buf_rows, _history_timer
+    with _history_lock:
+        if _history_timer is not None:
+            _history_timer.cancel()
+            _history_timer = None
+        pending, _history_buf, _history_buf_rows = _history_buf, {}, 0
+        for log_all_file, rows in pending.items():
+            f, w = _appender(log_all_file, HISTORY_HEADER)
+            w.writerows(rows)
+            f.flush()
+
+atexit.register(flush_history)
+
 def append_history(log_all_file: Path, runner_id: str, sql: str) -> None:
-    is_new = not log_all_file.exists()
-    with log_all_file.open("a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if is_new:
-            w.writerow(["ts", "runner_id", "sql"])
-        w.writerow([datetime.now().isoformat(timespec="seconds"), runner_id, sql])
+    global _history_buf_rows, _history_timer
+    row = [datetime.now().isoformat(timespec="seconds"), runner_id, sql]
+    # resolve now: the flush runs later, possibly after the notebook changed cwd
+    key = Path(log_all_file).resolve()
+    with _history_lock:
+        _history_buf.setdefault(key, []).append(row)
+        _history_buf_rows += 1
+        full = _history_buf_rows >= HISTORY_FLUSH_ROWS
+        if not full and _history_timer is None:
+            _history_timer = threading.Timer(HISTORY_FLUSH_SECONDS, flush_history)
+            _history_timer.daemon = True
+            _history_timer.start()
+    if full:
+        flush_history()
 
 def load_latest_map(log_latest_file: Path) -> Dict[str, str]:
     if not log_latest_file.exists():
@@ -34,8 +87,43 @@ def save_latest_map(log_latest_file: Path, latest: Dict[str, str]) -> None:
     with log_latest_file.open("w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(["runner_id", "sql"])
-        for rid, sql in latest.items():
-            w.writerow([rid, sql])
+        w.writerows(latest.items())
+
+# state db path -> open connection, shared by every runner in the kernel
+_STATE_CONNS: Dict[Path, sqlite3.Connection] = {}
+
+def _state_conn(state_db_file: Path, legacy_latest_file: Optional[Path] = None) -> sqlite3.Connection:
+    key = state_db_file.resolve()
+    conn = _STATE_CONNS.get(key)
+    if conn is not None:
+        return conn
+
+    conn = sqlite3.connect(str(state_db_file))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS latest (runner_id TEXT PRIMARY KEY, sql TEXT NOT NULL)")
+        # one-time import of the CSV store used by older versions
+        empty = conn.execute("SELECT 1 FROM latest LIMIT 1").fetchone() is None
+        if empty and legacy_latest_file is not None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO latest(runner_id, sql) VALUES (?, ?)",
+                load_latest_map(legacy_latest_file).items(),
+            )
+    _STATE_CONNS[key] = conn
+    return conn
+
+def load_latest_sql(
+    state_db_file: Path, runner_id: str, legacy_latest_file: Optional[Path] = None
+) -> Optional[str]:
+    conn = _state_conn(state_db_file, legacy_latest_file)
+    row = conn.execute("SELECT sql FROM latest WHERE runner_id = ?", (runner_id,)).fetchone()
+    return row[0] if row else None
+
+def save_latest_sql(state_db_file: Path, runner_id: str, sql: str) -> None:
+    conn = _state_conn(state_db_file)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO latest(runner_id, sql) VALUES (?, ?)", (runner_id, sql))
 
 def load_scores(score_file: Path) -> Dict[str, Dict[str, Any]]:
     if not score_file.exists():
@@ -52,11 +140,10 @@ def load_scores(score_file: Path) -> Dict[str, Dict[str, Any]]:
     return scores
 
 def save_scores(score_file: Path, scores: Dict[str, Dict[str, Any]]) -> None:
-    is_new = not score_file.exists()
-    with score_file.open("a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if is_new:
-            w.writerow(["runner_id", "current_points", "max_points", "attempt"])
-        for rid, rec in scores.items():
-            w.writerow([rid, rec.get("current_points"), rec.get("max_points"), rec.get("attempt")])
+    f, w = _appender(score_file, SCORES_HEADER)
+    w.writerows(
+        [rid, rec.get("current_points"), rec.get("max_points"), rec.get("attempt")]
+        for rid, rec in scores.items()
+    )
+    f.flush()
 
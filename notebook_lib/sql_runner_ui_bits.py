@@ -2,8 +2,17 @@
 from __future__ import annotations
 import html as _html
 import random
+from functools import lru_cache
+from typing import Dict, Optional, Set, Tuple
+import numpy as np
+from IPython import get_ipython
 from IPython.display import display, HTML
 
+try:
+    from markdown import markdown as _markdown_render
+except ImportError:
+    _markdown_render = None
+
 SUCCESS_MESSAGES = [
     "👏 Nice!", "💪 Great job", "👏 Good job", "👏 Keep up the good work!",
     "👏 I think you’re getting the hang of this!", "👏 Well played",
@@ -374,7 +383,7 @@ html[theme="dark"] .sql-runner{
     }
 
     /* -------------------------
-    Pandas Styler tables (results + schema)
+    Pandas tables (results + schema)
     ------------------------- */
     .sql-runner table.dataframe,
     .sql-runner .output table,
@@ -528,12 +537,10 @@ html[theme="dark"] .sql-runner{
 """
 
 
-def inject_css_once(css: str = SQL_RUNNER_CSS, style_id: str = "sql-runner-css") -> None:
-    """
-    Colab sometimes drops <style> that are emitted into an output area.
-    So we inject into document.head via JS (persisting across cells).
-    """
-    js = f"""
+SQL_RUNNER_STYLE_ID = "sql-runner-css"
+
+def _css_inject_js(css: str, style_id: str) -> str:
+    return f"""
     <script>
     (function() {{
       const id = {style_id!r};
@@ -546,15 +553,72 @@ def inject_css_once(css: str = SQL_RUNNER_CSS, style_id: str = "sql-runner-css")
     }})();
     </script>
     """
-    display(HTML(js))    
 
+@lru_cache(maxsize=16)
+def _css_inject_html(css: str, style_id: str) -> HTML:
+    return HTML(_css_inject_js(css, style_id))
+
+# (hash(css), execution_count) pairs already shipped to the frontend
+_CSS_INJECTED: Set[Tuple[int, Optional[int]]] = set()
+
+def _execution_count() -> Optional[int]:
+    ip = get_ipython()
+    return getattr(ip, "execution_count", None)
+
+def inject_css_once(css: str = SQL_RUNNER_CSS, style_id: str = SQL_RUNNER_STYLE_ID) -> None:
+    """
+    Colab sometimes drops <style> that are emitted into an output area.
+    So we inject into document.head via JS (persisting across cells).
+
+    Colab renders every cell output in its own frame, so the guard is per
+    cell execution: several runners built by one cell share one payload.
+    """
+    key = (hash((style_id, css)), _execution_count())
+    if key in _CSS_INJECTED:
+        return
+    _CSS_INJECTED.add(key)
+
+    display(_css_inject_html(css, style_id))
+
+@lru_cache(maxsize=512)
 def md_to_html(md: str) -> str:
-    try:
-        import markdown as _md
-        return _md.markdown(md)
-    except Exception:
-        return "<br>".join(_html.escape(md).splitlines())    
+    if _markdown_render is not None:
+        return _markdown_render(md)
+    return "<br>".join(_html.escape(md).splitlines())
+
+# (css_class, md) -> wrapped HTML, shared by every runner in the kernel
+_MD_BLOCK_CACHE: Dict[Tuple[str, str], str] = {}
+
+def render_md_block(md: str, css_class: str) -> str:
+    """
+    Returns md rendered inside <div class='{css_class}'>, converting each
+    unique (css_class, md) pair only once per kernel.
+    """
+    key = (css_class, md)
+    block = _MD_BLOCK_CACHE.get(key)
+    if block is None:
+        block = f"<div class='{css_class}'>{md_to_html(md)}</div>"
+        _MD_BLOCK_CACHE[key] = block
+    return block
     
+def render_df_table(df) -> str:
+    """
+    Plain DataFrame.to_html (no Styler): the CSS above already styles
+    table.dataframe, and cell values are HTML-escaped.
+    """
+    # na_rep only reaches NaN in float columns; NaT, <NA> and None would show
+    # as themselves, so spell those NULL in an object copy of the column
+    na = df.isna()
+    fix = [
+        i for i in range(df.shape[1])
+        if na.iloc[:, i].any() and not (isinstance(df.dtypes.iloc[i], np.dtype) and df.dtypes.iloc[i].kind == "f")
+    ]
+    if fix:
+        df = df.copy(deep=False)
+        for i in fix:
+            df.isetitem(i, df.iloc[:, i].astype(object).where(~na.iloc[:, i], "NULL"))
+    return df.to_html(index=False, na_rep="NULL", border=0)
+
 def pick_success_title() -> str:
     return random.choice(SUCCESS_MESSAGES)    
 
@@ -573,17 +637,29 @@ def render_score_badge(current_points=None, max_points=None, attempt=None) -> st
 
     return "<span class='score'>" + " &nbsp;|&nbsp; ".join(parts) + "</span>"
 
-def render_validation_banner(ok: bool, title: str, message: str, box_id: str) -> str:
-    cls = "ok" if ok else "err"
+# Titles come from a small fixed pool, so escape them once at import
+_ESCAPED_TITLES = {t: _html.escape(t) for t in SUCCESS_MESSAGES + ["🙁 Not correct yet"]}
 
-    return f"""
+_VALIDATION_TMPL = """
       <div id="{box_id}" class="sql-validation {cls}">
         <div class="close" onclick="document.getElementById('{box_id}').remove()">✕</div>
-        <b>{_html.escape(title)}</b>
-        {_html.escape(message)}
+        <b>{title}</b>
+        {message}
       </div>
     """
 
+def render_validation_banner(ok: bool, title: str, message: str, box_id: str) -> str:
+    safe_title = _ESCAPED_TITLES.get(title)
+    if safe_title is None:
+        safe_title = _html.escape(title)
+
+    return _VALIDATION_TMPL.format(
+        box_id=box_id,
+        cls="ok" if ok else "err",
+        title=safe_title,
+        message=_html.escape(message) if message else "",
+    )
+
 def render_submit_banner(
     *,
     box_id: str,
@@ -1,9 +1,205 @@
 # notebook_lib/validators.py
 from __future__ import annotations
 
+import csv
 import hashlib
+import io
+import os
 import random
-import pandas as pd
+import re
+import sqlite3
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+
+@lru_cache(maxsize=None)
+def _load_deps() -> None:
+    """
+    Import numpy/pandas on the first fingerprint instead of at module import,
+    so notebooks that never validate a result don't pay for them up front.
+    Binds the module globals the helpers below use.
+    """
+    global np, pd, infer_dtype, is_bool_dtype, is_float_dtype, is_integer_dtype, pa, pc
+    import numpy as np
+    import pandas as pd
+    from pandas.api.types import infer_dtype, is_bool_dtype, is_float_dtype, is_integer_dtype
+
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        pa = pc = None
+
+
+class _HashSink(io.RawIOBase):
+    """Write-only binary stream that feeds everything into a hash object."""
+
+    def __init__(self, h):
+        self._h = h
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._h.update(b)
+        return len(b)
+
+
+def _new_hash(hash_algo: str):
+    # blake2b is cut to 32 bytes so digests keep the sha256 length
+    if hash_algo == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    return hashlib.new(hash_algo)
+
+
+def _check_hash_algo(hash_algo: str) -> None:
+    """Fail when an exercise is authored, not at a student's first validation."""
+    try:
+        h = _new_hash(hash_algo)
+    except (TypeError, ValueError):
+        raise ValueError(f"unknown hash_algo {hash_algo!r}") from None
+    if h.digest_size == 0:
+        # shake_128/shake_256 need a length for .digest()
+        raise ValueError(f"hash_algo {hash_algo!r} has no fixed digest size; use e.g. 'sha256' or 'blake2b'")
+
+
+def _csv_header(labels: pd.Index) -> str:
+    """
+    The header to_csv(index=False) writes for these column labels. pandas
+    formats labels its own way (NaN/None as "", float and datetime labels,
+    MultiIndex rows), so let it write the header of an empty frame.
+    """
+    _load_deps()
+    return pd.DataFrame(columns=labels).to_csv(index=False)
+
+
+def _csv_digest(labels: pd.Index, columns: list, hash_algo: str = "sha256") -> bytes:
+    """
+    Hash of exactly what DataFrame.to_csv(index=False) would produce for
+    these labels and (already string) columns, streamed row by row instead
+    of building the whole payload string first.
+    """
+    h = _new_hash(hash_algo)
+    with io.TextIOWrapper(io.BufferedWriter(_HashSink(h), 1 << 16), encoding="utf-8", newline="") as out:
+        out.write(_csv_header(labels))
+        # same dialect pandas hands to the csv module
+        w = csv.writer(out, lineterminator=os.linesep)
+        w.writerows(zip(*columns))
+    return h.digest()
+
+
+def _empty_digest(columns: pd.Index, sort_cols: bool, hash_algo: str = "sha256") -> bytes:
+    """Digest of a frame with these columns and no rows: just the CSV header."""
+    if sort_cols:
+        labels = list(columns)
+        columns = columns[sorted(range(len(labels)), key=labels.__getitem__)]
+    return _csv_digest(columns, [], hash_algo)
+
+
+@lru_cache(maxsize=8192)
+def _fmt2_cached(v: float) -> str:
+    return f"{v:.2f}"
+
+
+def _fmt2(v: float) -> str:
+    # 0.0 == -0.0 share a cache slot, but they format differently
+    return _fmt2_cached(v) if v else f"{v:.2f}"
+
+
+def _format_2f(vals: np.ndarray, na_token: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (strings, inverse) for a float64 array, formatting each distinct value once;
+    strings[inverse] is the normalized column. Distinct means distinct bit
+    pattern, so -0.0 keeps its own "-0.00".
+    """
+    bits, inverse = np.unique(vals.view(np.uint64), return_inverse=True)
+    uniq = bits.view(np.float64)
+    strs = np.array([f"{v:.2f}" for v in uniq.tolist()], dtype=object)
+    strs[np.isnan(uniq)] = na_token
+    return strs, inverse.reshape(vals.shape)
+
+
+def _norm_cell(v, na_token: str = "<NA>", normalize_whitespace: bool = True) -> str:
+    if pd.isna(v):
+        return na_token
+    # Normalize numbers deterministically (prevents 9.8999999999 issues)
+    if isinstance(v, (float, int)) and not isinstance(v, bool):
+        # choose decimals appropriate to your course; money is usually 2
+        return _fmt2(float(v))
+    s = str(v)
+    if normalize_whitespace:
+        s = " ".join(s.split())
+    return s
+
+
+def _is_numeric_col(col: pd.Series) -> bool:
+    return (is_float_dtype(col) or is_integer_dtype(col)) and not is_bool_dtype(col)
+
+
+def _normalize_column(col: pd.Series, na_token: str, normalize_whitespace: bool) -> np.ndarray:
+    """
+    Same strings as col.map(_norm_cell), but the dtype is checked once per
+    column instead of running pd.isna/isinstance on every cell.
+    """
+    if _is_numeric_col(col):
+        strs, inverse = _format_2f(col.to_numpy(dtype="float64", na_value=np.nan), na_token)
+        return strs[inverse]
+
+    if infer_dtype(col, skipna=True) == "string":
+        na = col.isna().to_numpy()
+        vals = col.to_numpy(dtype=object, na_value=na_token)
+        if normalize_whitespace:
+            # SQL results repeat strings a lot; collapse each distinct value once
+            codes, uniq = pd.factorize(vals)
+            out = np.array([" ".join(v.split()) for v in uniq.tolist()], dtype=object)[codes]
+        else:
+            out = vals.copy()
+        out[na] = na_token
+        return out
+
+    # mixed / other object columns: per-cell (ints inside object still become "1.00",
+    # NumPy scalars stay str()-formatted), so no cheaper specialization applies
+    norm = partial(_norm_cell, na_token=na_token, normalize_whitespace=normalize_whitespace)
+    return col.map(norm).to_numpy(dtype=object)
+
+
+def _normalize_numeric_block(cols: list, na_token: str) -> tuple[list, list]:
+    """
+    Normalize an all-numeric frame as one float64 block: each distinct value is
+    formatted once and the sort ranks come from the distinct strings, so SQL
+    aggregates full of repeated values skip most of the per-cell formatting.
+    Returns (string columns, rank codes) matching _normalize_column + factorize.
+    """
+    block = np.column_stack([c.to_numpy(dtype="float64", na_value=np.nan) for c in cols])
+    strs, inverse = _format_2f(block, na_token)
+    ranks = pd.factorize(strs, sort=True)[0]
+    columns = [strs[inverse[:, j]] for j in range(block.shape[1])]
+    codes = [ranks[inverse[:, j]] for j in range(block.shape[1])]
+    return columns, codes
+
+
+def _arrow_row_order(columns: list):
+    """
+    Stable multi-key sort of the normalized string columns with pyarrow, or
+    None if pyarrow is missing or a value can't be encoded (lone surrogates).
+    Arrow compares UTF-8 bytes, which orders like Python's code point
+    comparison, so this matches the factorize + lexsort path.
+    """
+    if pa is None:
+        return None
+    try:
+        table = pa.table({str(i): pa.array(c, type=pa.string()) for i, c in enumerate(columns)})
+    except (pa.ArrowException, UnicodeError):
+        return None
+    keys = [(str(i), "ascending") for i in range(len(columns))]
+    return pc.sort_indices(table, sort_keys=keys).to_numpy()
 
 
 def df_fingerprint(
@@ -13,37 +209,322 @@ def df_fingerprint(
     sort_cols: bool = False,
     normalize_whitespace: bool = True,
     na_token: str = "<NA>",
+    fast: bool = False,
+    hash_algo: str = "sha256",
 ) -> tuple[str, dict]:
-    x = df.copy()
+    """
+    (hex digest, meta) of a result frame; the hex digest is what notebooks
+    store as expected_hash.
 
-    if sort_cols:
-        x = x.reindex(sorted(x.columns), axis=1)
-
-    def norm(v):
-        if pd.isna(v):
-            return na_token
-        # Normalize numbers deterministically (prevents 9.8999999999 issues)
-        if isinstance(v, (float, int)) and not isinstance(v, bool):
-            # choose decimals appropriate to your course; money is usually 2
-            return f"{float(v):.2f}"
-        s = str(v)
-        if normalize_whitespace:
-            s = " ".join(s.split())
-        return s
+    fast=True hashes the normalized cells with pd.util.hash_pandas_object
+    and ignores row order by sorting the per-row hashes. It is much quicker
+    but gives different digests than the default CSV-based ones (and may
+    change between pandas versions), so expected hashes must be generated
+    with fast=True as well.
 
-    x = x.map(norm)
+    hash_algo is any hashlib name; "blake2b" (32-byte digest) is cheaper
+    than the default "sha256" but changes every digest, so expected hashes
+    must be generated with the same algorithm.
+    """
+    _check_hash_algo(hash_algo)
+    digest, meta = _df_digest(
+        df,
+        sort_rows=sort_rows,
+        sort_cols=sort_cols,
+        normalize_whitespace=normalize_whitespace,
+        na_token=na_token,
+        fast=fast,
+        hash_algo=hash_algo,
+    )
+    return digest.hex(), meta
 
-    if sort_rows and len(x.columns) > 0 and len(x) > 0:
-        x = x.sort_values(by=list(x.columns), kind="mergesort").reset_index(drop=True)
-    else:
-        x = x.reset_index(drop=True)
 
-    payload = x.to_csv(index=False)
-    h = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+def _df_digest(
+    df: pd.DataFrame,
+    *,
+    sort_rows: bool = True,
+    sort_cols: bool = False,
+    normalize_whitespace: bool = True,
+    na_token: str = "<NA>",
+    fast: bool = False,
+    hash_algo: str = "sha256",
+) -> tuple[bytes, dict]:
+    """df_fingerprint with the raw digest bytes, for comparing without hex."""
     meta = {"rows": int(len(df)), "cols": list(df.columns)}
+    if len(df) == 0 and len(df.columns) > 0 and not fast:
+        return _empty_digest(df.columns, sort_cols, hash_algo), meta
+    _load_deps()
+
+    # no defensive copy: every step below builds new arrays and never touches df
+    x = df
+
+    # pick columns by position instead of reindexing, which would copy the whole
+    # frame; positional also keeps duplicate column labels as separate columns
+    positions = range(x.shape[1])
+    if sort_cols:
+        labels = list(x.columns)
+        if len(set(labels)) != len(labels):
+            raise ValueError("cannot reindex on an axis with duplicate labels")
+        positions = sorted(positions, key=labels.__getitem__)
+    codes = None
+    if len(x) > 0 and positions and all(_is_numeric_col(x.iloc[:, i]) for i in positions):
+        columns, codes = _normalize_numeric_block([x.iloc[:, i] for i in positions], na_token)
+    else:
+        columns = [_normalize_column(x.iloc[:, i], na_token, normalize_whitespace) for i in positions]
+    cols = [x.columns[i] for i in positions]
+
+    if fast:
+        h = _new_hash(hash_algo)
+        h.update("\x1f".join(map(str, cols)).encode("utf-8") + b"\x1e")
+        if not cols:
+            # nothing to hash per row, only how many rows there are
+            h.update(len(x).to_bytes(8, "little"))
+            return h.digest(), meta
+        x = pd.DataFrame(dict(enumerate(columns)), index=range(len(x)), columns=range(len(cols)), dtype=object)
+        rows = pd.util.hash_pandas_object(x, index=False, categorize=False).to_numpy(dtype=np.uint64)
+        if sort_rows:
+            rows = np.sort(rows)
+        h.update(rows.tobytes())
+        return h.digest(), meta
+
+    if sort_rows and columns and len(x) > 0:
+        # rank each column's strings, then one stable lexsort over the int codes
+        # (the same ordering sort_values(kind="mergesort") produced); ranking
+        # many distinct strings is slow in pandas, so Arrow sorts those frames
+        order = _arrow_row_order(columns) if codes is None else None
+        if order is None:
+            if codes is None:
+                codes = [pd.factorize(c, sort=True)[0] for c in columns]
+            order = np.lexsort(codes[::-1])
+        columns = [c[order] for c in columns]
+
+    if cols:
+        h = _csv_digest(x.columns[list(positions)], columns, hash_algo)
+    else:
+        payload = x.to_csv(index=False)
+        h = _new_hash(hash_algo)
+        h.update(payload.encode("utf-8"))
+        h = h.digest()
     return h, meta
 
 
+def _strip_sql(sql: str) -> str:
+    return sql.strip().rstrip(";").rstrip()
+
+
+def _query_count(conn, sql: str) -> int | None:
+    """
+    Row count via COUNT(*), or None if the SQL can't be wrapped as a subquery
+    (e.g. a ';' followed by a comment); the caller then fetches the result.
+    """
+    # newline so a trailing "-- comment" can't swallow the closing paren
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM (\n{sql}\n) AS q").fetchone()[0]
+    except Exception:
+        return None
+
+
+def _query_df(conn, sql: str) -> pd.DataFrame:
+    if isinstance(conn, sqlite3.Connection):
+        _load_deps()
+        return pd.read_sql_query(sql, conn)
+    return conn.execute(sql).df()
+
+
+def _hex_to_int(hex_hash: str | None) -> int | None:
+    # None if missing or not hex, so nothing matches; forgives case and stray whitespace
+    if hex_hash is None:
+        return None
+    try:
+        return int.from_bytes(bytes.fromhex(hex_hash.strip()), "big")
+    except ValueError:
+        return None
+
+
+def _sample_frame(df: pd.DataFrame, sample_rows: int) -> pd.DataFrame:
+    if len(df) <= sample_rows:
+        return df
+    _load_deps()
+    half = sample_rows // 2
+    return pd.concat([df.iloc[:half], df.iloc[len(df) - (sample_rows - half):]])
+
+
+def _sample_digest(df: pd.DataFrame, sample_rows: int, *, sort_cols: bool, fast: bool, hash_algo: str) -> bytes:
+    """Raw sample digest; the one copy both df_sample_fingerprint and the validator use."""
+    digest, _ = _df_digest(
+        _sample_frame(df, sample_rows), sort_rows=False, sort_cols=sort_cols, fast=fast, hash_algo=hash_algo
+    )
+    return digest
+
+
+def df_sample_fingerprint(
+    df: pd.DataFrame,
+    *,
+    sample_rows: int = 2000,
+    sort_cols: bool = False,
+    fast: bool = False,
+    hash_algo: str = "sha256",
+) -> str:
+    """
+    "<sample_rows>:<hex digest>" of the first/last sample_rows rows (in order),
+    to pass as expected_sample_hash next to expected_hash for validators built
+    with sort_rows=False. The validator samples the same number of rows.
+    """
+    _check_hash_algo(hash_algo)
+    digest = _sample_digest(df, sample_rows, sort_cols=sort_cols, fast=fast, hash_algo=hash_algo)
+    return f"{sample_rows}:{digest.hex()}"
+
+
+def _parse_sample_hash(sample_hash: str) -> tuple[int, int | None]:
+    """(sample_rows, digest as int) from a df_sample_fingerprint value."""
+    rows, sep, hex_hash = sample_hash.partition(":")
+    if not sep or not rows.strip().isdigit() or int(rows) < 1:
+        raise ValueError(
+            f"expected_sample_hash must come from df_sample_fingerprint ('<rows>:<hex>'), got {sample_hash!r}"
+        )
+    return int(rows), _hex_to_int(hex_hash)
+
+
+@dataclass(frozen=True, slots=True)
+class _DfValidator:
+    """
+    Callable validator built by make_df_validator_nospoilers. Plain fields
+    instead of closure cells, so it can also be pickled (e.g. to hand a
+    grading run to multiprocessing); the fingerprint cache is not pickled.
+    """
+
+    expected_hash: str
+    required_cols: tuple = ()
+    exact_cols: bool = False
+    expected_rows: int | None = None
+    sort_rows: bool = True
+    sort_cols: bool = False
+    hide_missing_cols: bool = True
+    hide_row_count: bool = False
+    fast: bool = False
+    hash_algo: str = "sha256"
+    expected_sample_hash: str | None = None
+    required_set: frozenset = field(init=False, repr=False, compare=False)
+    # expected_hash / expected_sample_hash as ints, see _hex_to_int
+    expected_int: int | None = field(init=False, repr=False, compare=False)
+    expected_sample_int: int | None = field(init=False, repr=False, compare=False)
+    # rows sampled for expected_sample_hash, parsed from its "<rows>:" prefix
+    sample_rows: int | None = field(init=False, repr=False, compare=False)
+    # df_fingerprint with this validator's options bound once
+    fp_func: partial = field(init=False, repr=False, compare=False)
+    # (id(df), shape, columns) -> (weakref to df, hash) for the last few frames seen by this
+    # validator; df is held weakly so cached results don't pin frames in memory,
+    # and the ref() is df check still guards against a reused id
+    fp_cache: OrderedDict = field(init=False, repr=False, compare=False)
+
+    _FP_CACHE_SIZE = 5
+
+    def __post_init__(self):
+        _check_hash_algo(self.hash_algo)
+        object.__setattr__(self, "required_set", frozenset(self.required_cols))
+        if self.expected_sample_hash is not None and self.sort_rows:
+            # head/tail of a row-order-insensitive result would reject correct answers
+            raise ValueError("expected_sample_hash requires sort_rows=False")
+        object.__setattr__(self, "expected_int", _hex_to_int(self.expected_hash))
+        sample_rows = sample_int = None
+        if self.expected_sample_hash is not None:
+            sample_rows, sample_int = _parse_sample_hash(self.expected_sample_hash)
+        object.__setattr__(self, "sample_rows", sample_rows)
+        object.__setattr__(self, "expected_sample_int", sample_int)
+        object.__setattr__(self, "fp_func", partial(
+            _df_digest, sort_rows=self.sort_rows, sort_cols=self.sort_cols, fast=self.fast, hash_algo=self.hash_algo
+        ))
+        object.__setattr__(self, "fp_cache", OrderedDict())
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, f.name) for f in fields(self) if f.init)
+
+    def _cached_fingerprint(self, df: pd.DataFrame) -> bytes | None:
+        key = (id(df), df.shape, tuple(df.columns))
+        hit = self.fp_cache.get(key)
+        if hit is not None and hit[0]() is df:
+            self.fp_cache.move_to_end(key)
+            return hit[1]
+        return None
+
+    def fingerprint(self, df: pd.DataFrame) -> bytes:
+        """
+        Raw digest of df (not hex), cached for the last few frames. The cache
+        is keyed on the frame object, so a frame changed in place after it was
+        validated keeps its old digest; pass a new frame (or a copy) instead.
+        """
+        cached = self._cached_fingerprint(df)
+        if cached is not None:
+            return cached
+        fp_cache = self.fp_cache
+        key = (id(df), df.shape, tuple(df.columns))
+        got_hash, _ = self.fp_func(df)
+        fp_cache[key] = (weakref.ref(df), got_hash)
+        while len(fp_cache) > self._FP_CACHE_SIZE:
+            fp_cache.popitem(last=False)
+        return got_hash
+
+    def _column_problems(self, columns) -> list | None:
+        required_cols = self.required_cols
+        if not required_cols:
+            return None
+        cols_set = set(columns)
+
+        missing = [c for c in required_cols if c not in cols_set]
+        if missing:
+            if self.hide_missing_cols:
+                return ["Wrong number of columns! Make corrections and try again."]
+            return [f"Missing column(s): {', '.join(missing)}"]
+
+        if self.exact_cols and cols_set != self.required_set:
+            return ["Wrong number of columns! Make corrections and try again."]
+        return None
+
+    def _row_problems(self, n_rows: int) -> list | None:
+        if self.expected_rows is not None and n_rows != self.expected_rows:
+            if self.hide_row_count:
+                return ["Wrong number of rows! Make corrections and try again."]
+            return ["Wrong number of rows! Make corrections and try again."]
+        return None
+
+    def validate_from_preview(self, sql: str, preview: pd.DataFrame, conn):
+        """
+        Validate a query the runner only fetched up to its display cap:
+        columns are checked on the preview and the row count with COUNT(*),
+        so only an answer that passes both pays for fetching the full result.
+        """
+        problems = self._column_problems(preview.columns)
+        if problems:
+            return False, problems
+        sql = _strip_sql(sql)
+        n_rows = _query_count(conn, sql) if self.expected_rows is not None else None
+        if n_rows is not None:
+            problems = self._row_problems(n_rows)
+            if problems:
+                return False, problems
+        return self(sql, _query_df(conn, sql), conn)
+
+    def __call__(self, sql: str, df: pd.DataFrame, conn ):
+        problems = self._column_problems(df.columns) or self._row_problems(len(df))
+        if problems:
+            return False, problems
+
+        got_hash = self._cached_fingerprint(df)
+        if got_hash is None:
+            if self.sample_rows is not None and len(df) > self.sample_rows:
+                # cheap first pass on the first/last rows; only a match pays for the full hash
+                got_sample = _sample_digest(
+                    df, self.sample_rows, sort_cols=self.sort_cols, fast=self.fast, hash_algo=self.hash_algo
+                )
+                if int.from_bytes(got_sample, "big") != self.expected_sample_int:
+                    return False, ["The result is not correct yet. Make corrections and try again."]
+            got_hash = self.fingerprint(df)
+        if int.from_bytes(got_hash, "big") != self.expected_int:
+            return False, ["The result is not correct yet. Make corrections and try again."]
+
+        return True, [""]
+
+
 def make_df_validator_nospoilers(
     expected_hash: str,
     *,
@@ -54,82 +535,73 @@ def make_df_validator_nospoilers(
     sort_cols: bool = False,
     hide_missing_cols: bool = True,
     hide_row_count: bool = False,
+    fast: bool = False,
+    hash_algo: str = "sha256",
+    expected_sample_hash: str | None = None,
 ):
-    required_cols = required_cols or []
-
-    def validator(sql: str, df: pd.DataFrame, conn ):
-        problems = []
-        structural_issue = False
-
-        if required_cols:
-            missing = [c for c in required_cols if c not in df.columns]
-            if missing:
-                structural_issue = True
-                if hide_missing_cols:
-                    problems.append("Wrong number of columns! Make corrections and try again.")
-                else:
-                    problems.append(f"Missing column(s): {', '.join(missing)}")
-                return False, problems
+    return _DfValidator(
+        expected_hash,
+        required_cols=tuple(required_cols or ()),
+        exact_cols=exact_cols,
+        expected_rows=expected_rows,
+        sort_rows=sort_rows,
+        sort_cols=sort_cols,
+        hide_missing_cols=hide_missing_cols,
+        hide_row_count=hide_row_count,
+        fast=fast,
+        hash_algo=hash_algo,
+        expected_sample_hash=expected_sample_hash,
+    )
 
-        if exact_cols and required_cols:
-            if set(df.columns) != set(required_cols):
-                structural_issue = True
-                return False, ["Wrong number of columns! Make corrections and try again."]
 
-        if structural_issue:
-            return False, problems
+# Literal each process rule looks for in the lowercased, whitespace-collapsed SQL
+_PROCESS_RULE_TOKENS = {
+    "where": "where",
+    "join": " join ",
+    "group_by": "group by",
+    "having": "having",
+    "distinct": "distinct",
+    "order_by": "order by",
+    "limit": "limit",
+    "subquery": "(select",
+}
 
-        if expected_rows is not None and len(df) != expected_rows:
-            if hide_row_count:
-                return False, ["Wrong number of rows! Make corrections and try again."]
-            return False, ["Wrong number of rows! Make corrections and try again."]
+# One scan finds every rule at once; the lookahead lets occurrences overlap
+# (e.g. "havingroup by"), exactly like separate `in` checks would.
+_PROCESS_RULE_RE = re.compile(
+    "(?=(?:" + "|".join(f"(?P<{k}>{re.escape(v)})" for k, v in _PROCESS_RULE_TOKENS.items()) + "))"
+)
 
-        got_hash, _ = df_fingerprint(df, sort_rows=sort_rows, sort_cols=sort_cols)
-        if got_hash != expected_hash:
-            return False, ["The result is not correct yet. Make corrections and try again."]
-
-        return True, [""]
-
-    return validator
+_PROCESS_RULE_MESSAGES = {
+    "where": "Use a WHERE clause.",
+    "join": "Use a JOIN in this exercise.",
+    "group_by": "Use GROUP BY in this exercise.",
+    "having": "Use HAVING in this exercise.",
+    "distinct": "Use DISTINCT in this exercise.",
+    "order_by": "Don’t use ORDER BY for this exercise.",
+    "limit": "Don’t use LIMIT for this exercise.",
+    "subquery": "Don’t use subqueries for this exercise.",
+}
 
 
 def check_process_rules(sql: str, *, require=None, forbid=None) -> tuple[bool, list[str]]:
     require = require or []
     forbid = forbid or []
-    s = " ".join(sql.lower().split())
-
-    def has(token: str) -> bool:
-        if token == "where": return "where" in s
-        if token == "join": return " join " in s
-        if token == "group_by": return "group by" in s
-        if token == "having": return "having" in s
-        if token == "distinct": return "distinct" in s
-        if token == "order_by": return "order by" in s
-        if token == "limit": return "limit" in s
-        if token == "subquery": return "(select" in s
-        raise KeyError(token)
-
-    messages = {
-        "where": "Use a WHERE clause.",
-        "join": "Use a JOIN in this exercise.",
-        "group_by": "Use GROUP BY in this exercise.",
-        "having": "Use HAVING in this exercise.",
-        "distinct": "Use DISTINCT in this exercise.",
-        "order_by": "Don’t use ORDER BY for this exercise.",
-        "limit": "Don’t use LIMIT for this exercise.",
-        "subquery": "Don’t use subqueries for this exercise.",
-    }
+    messages = _PROCESS_RULE_MESSAGES
 
     unknown = [t for t in set(require) | set(forbid) if t not in messages]
     if unknown:
         return False, [f"Internal error: unknown process rule(s): {unknown}"]
 
+    s = " ".join(sql.lower().split())
+    found = {m.lastgroup for m in _PROCESS_RULE_RE.finditer(s)}
+
     for t in require:
-        if not has(t):
+        if t not in found:
             return False, [messages[t]]
 
     for t in forbid:
-        if has(t):
+        if t in found:
             return False, [messages[t]]
 
     return True, []
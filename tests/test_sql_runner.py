@@ -0,0 +1,140 @@
+import sqlite3
+
+import duckdb
+import ipywidgets as widgets
+import pandas as pd
+import pytest
+
+import notebook_lib.sql_runner as sr
+from notebook_lib.sql_runner import _NONDETERMINISTIC_RE, _fetch_duckdb_limited
+from notebook_lib.validators import df_fingerprint, make_df_validator_nospoilers
+
+
+@pytest.fixture
+def duck():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE t AS SELECT range AS a, range % 7 AS b FROM range(100000)")
+    yield conn
+    conn.close()
+
+
+def test_fetch_duckdb_limited_filtered_query_returns_all_rows(duck):
+    # filtered scans hand out partly filled vectors
+    df = _fetch_duckdb_limited(duck, "SELECT * FROM t WHERE a % 1000 = 0", 1001)
+    assert len(df) == 100
+    assert df["a"].tolist() == list(range(0, 100000, 1000))
+
+
+def test_fetch_duckdb_limited_stops_at_limit(duck):
+    df = _fetch_duckdb_limited(duck, "SELECT * FROM t WHERE b = 3", 1001)
+    assert len(df) == 1001
+    assert (df["b"] == 3).all()
+
+
+def test_fetch_duckdb_limited_empty_result_keeps_columns(duck):
+    df = _fetch_duckdb_limited(duck, "SELECT * FROM t WHERE a < 0", 1001)
+    assert len(df) == 0
+    assert list(df.columns) == ["a", "b"]
+
+
+@pytest.mark.parametrize("sql,volatile", [
+    ("SELECT random()", True),
+    ("SELECT * FROM t ORDER BY RANDOM() LIMIT 3", True),
+    ("SELECT datetime('now')", True),
+    ("SELECT CURRENT_TIMESTAMP", True),
+    ("SELECT * FROM t", False),
+    ("SELECT * FROM randoms WHERE now_col = 1", False),
+])
+def test_nondeterministic_sql_is_detected(sql, volatile):
+    assert bool(_NONDETERMINISTIC_RE.search(sql)) is volatile
+
+
+# ---------- driving a runner ----------
+
+def _find(w, cls):
+    found = [w] if isinstance(w, cls) else []
+    for c in getattr(w, "children", ()) or ():
+        found += _find(c, cls)
+    return found
+
+
+class Runner:
+    """A runner UI plus the frames/validations it produced, for tests."""
+
+    def __init__(self, conn, monkeypatch, tmp_path, **kwargs):
+        monkeypatch.chdir(tmp_path)
+        shown = []
+        monkeypatch.setattr(sr, "display", lambda obj, *a, **k: shown.append(obj))
+        self.frames = []
+        real_run = sr.render_df_table
+        monkeypatch.setattr(sr, "render_df_table", lambda df: self.frames.append(df.copy()) or real_run(df))
+        sr._RESULT_CACHE.clear()
+        sr.make_sql_runner(conn, runner_id=f"t{id(self)}", **kwargs)
+        self.ui = [w for w in shown if isinstance(w, widgets.VBox)][-1]
+        self.box = _find(self.ui, widgets.Textarea)[0]
+        self.run_btn = [b for b in _find(self.ui, widgets.Button) if b.description == "▶"][0]
+
+    def run(self, sql):
+        self.box.value = sql
+        self.run_btn.click()
+
+
+@pytest.fixture
+def people():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        "CREATE TABLE p(name TEXT); INSERT INTO p VALUES ('Ann  Lee'), ('Ann Lee');"
+    )
+    yield conn
+    conn.close()
+
+
+def test_result_cache_keeps_string_literals_apart(people, monkeypatch, tmp_path):
+    runner = Runner(people, monkeypatch, tmp_path)
+    runner.run("SELECT name FROM p WHERE name = 'Ann  Lee'")
+    runner.run("SELECT name FROM p WHERE name = 'Ann Lee'")
+    assert [f["name"].tolist() for f in runner.frames] == [["Ann  Lee"], ["Ann Lee"]]
+
+
+def test_result_cache_sees_temp_view_replaced_outside_runner(people, monkeypatch, tmp_path):
+    people.execute("CREATE TEMP VIEW v AS SELECT 1 AS x")
+    runner = Runner(people, monkeypatch, tmp_path)
+    runner.run("SELECT * FROM v")
+    people.executescript("DROP VIEW v; CREATE TEMP VIEW v AS SELECT 2 AS x;")
+    runner.run("SELECT * FROM v")
+    assert [f["x"].tolist() for f in runner.frames] == [[1], [2]]
+
+
+def test_result_cache_skips_large_results(monkeypatch, tmp_path):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE big(n INTEGER)")
+    conn.executemany("INSERT INTO big VALUES (?)", [(i,) for i in range(5000)])
+    conn.commit()
+    runner = Runner(conn, monkeypatch, tmp_path, validator=make_df_validator_nospoilers("00"))
+    runner.run("SELECT n FROM big")
+    runner.run("SELECT n FROM big WHERE n < 10")
+    assert [len(df) for _, df, _ in sr._RESULT_CACHE.values()] == [sr.MAX_DISPLAY_ROWS + 1, 10]
+
+
+@pytest.fixture
+def numbers():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE big(n INTEGER)")
+    conn.executemany("INSERT INTO big VALUES (?)", [(i,) for i in range(5000)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _validations(runner):
+    return [w.value for w in _find(runner.ui, widgets.HTML) if "sql-validation" in w.value]
+
+
+def test_capped_result_is_validated_in_full(numbers, monkeypatch, tmp_path):
+    h, _ = df_fingerprint(pd.DataFrame({"n": range(5000)}))
+    runner = Runner(numbers, monkeypatch, tmp_path, validator=make_df_validator_nospoilers(h, expected_rows=5000))
+    runner.run("SELECT n FROM big")
+    assert len(runner.frames[-1]) == sr.MAX_DISPLAY_ROWS
+    assert "sql-validation ok" in _validations(runner)[0]
+    runner.run("SELECT n FROM big WHERE n > 0")
+    assert "sql-validation err" in _validations(runner)[0]
@@ -0,0 +1,59 @@
+import csv
+
+from notebook_lib import sql_runner_store as store
+
+
+def _rows(path):
+    with path.open(newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_history_is_buffered_until_flush(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log = tmp_path / "log.csv"
+    store.append_history(log, "r1", "SELECT 1")
+    store.append_history(log, "r2", "SELECT 2")
+    assert not log.exists()
+    store.flush_history()
+    rows = _rows(log)
+    assert rows[0] == store.HISTORY_HEADER
+    assert [r[1:] for r in rows[1:]] == [["r1", "SELECT 1"], ["r2", "SELECT 2"]]
+
+
+def test_history_flushes_when_the_batch_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "HISTORY_FLUSH_ROWS", 3)
+    log = tmp_path / "log.csv"
+    for i in range(3):
+        store.append_history(log, "r", f"SELECT {i}")
+    assert len(_rows(log)) == 4
+
+
+def test_history_path_is_resolved_when_buffered(tmp_path, monkeypatch):
+    first, second = tmp_path / "a", tmp_path / "b"
+    first.mkdir()
+    second.mkdir()
+    monkeypatch.chdir(first)
+    store.append_history(store.Path("log.csv"), "r", "SELECT 1")
+    monkeypatch.chdir(second)
+    store.flush_history()
+    assert (first / "log.csv").exists()
+    assert not (second / "log.csv").exists()
+
+
+def test_latest_sql_round_trip(tmp_path):
+    db = tmp_path / "state.db"
+    assert store.load_latest_sql(db, "r1") is None
+    store.save_latest_sql(db, "r1", "SELECT 1")
+    store.save_latest_sql(db, "r1", "SELECT 2")
+    assert store.load_latest_sql(db, "r1") == "SELECT 2"
+
+
+def test_latest_sql_imports_legacy_csv_once(tmp_path):
+    legacy = tmp_path / "latest.csv"
+    store.save_latest_map(legacy, {"r1": "SELECT 'old'", "r2": "SELECT 2"})
+    db = tmp_path / "state.db"
+    assert store.load_latest_sql(db, "r1", legacy) == "SELECT 'old'"
+    store.save_latest_sql(db, "r1", "SELECT 'new'")
+    store.save_latest_map(legacy, {"r1": "SELECT 'stale'"})
+    assert store.load_latest_sql(db, "r1", legacy) == "SELECT 'new'"
+    assert store.load_latest_sql(db, "r2", legacy) == "SELECT 2"
@@ -0,0 +1,293 @@
+import hashlib
+import pickle
+import sqlite3
+from dataclasses import fields
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+import notebook_lib.validators as validators
+from notebook_lib.validators import (
+    _PROCESS_RULE_TOKENS,
+    _query_df,
+    check_process_rules,
+    df_fingerprint,
+    df_sample_fingerprint,
+    make_df_validator_nospoilers,
+)
+
+EXPECTED = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+
+
+def _conn(kind):
+    conn = sqlite3.connect(":memory:") if kind == "sqlite" else duckdb.connect()
+    conn.execute("CREATE TABLE t(a INTEGER, b TEXT)")
+    conn.execute("INSERT INTO t VALUES (1, 'x'), (2, 'y')")
+    return conn
+
+
+@pytest.fixture(params=["sqlite", "duckdb"])
+def conn(request):
+    c = _conn(request.param)
+    yield c
+    c.close()
+
+
+@pytest.fixture
+def validator():
+    h, _ = df_fingerprint(EXPECTED)
+    return make_df_validator_nospoilers(h, required_cols=["a", "b"], expected_rows=2)
+
+
+def _preview(conn, sql):
+    # what the runner hands over when it stopped at its display cap
+    return _query_df(conn, sql).head(1)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM t",
+    "SELECT * FROM t;",
+    "SELECT * FROM t -- done",
+    "SELECT * FROM t; -- done",
+    "SELECT * FROM t; /* done */",
+])
+def test_validate_from_preview_accepts_valid_sql(conn, validator, sql):
+    assert validator.validate_from_preview(sql, _preview(conn, sql), conn) == (True, [""])
+
+
+def test_validate_from_preview_rejects_wrong_rows(conn, validator):
+    sql = "SELECT * FROM t WHERE a = 1; -- done"
+    ok, problems = validator.validate_from_preview(sql, _preview(conn, sql), conn)
+    assert not ok
+    assert problems == ["Wrong number of rows! Make corrections and try again."]
+
+
+def test_validate_from_preview_rejects_missing_columns(conn, validator):
+    sql = "SELECT a FROM t"
+    ok, problems = validator.validate_from_preview(sql, _preview(conn, sql), conn)
+    assert not ok
+    assert problems == ["Wrong number of columns! Make corrections and try again."]
+
+
+@pytest.mark.parametrize("columns", [
+    [None, "x"],
+    [np.nan, 1.5],
+    pd.to_datetime(["2024-01-01", "2024-02-01"]),
+])
+def test_fingerprint_header_matches_to_csv_for_odd_labels(columns):
+    df = pd.DataFrame([[1, "a"]], columns=columns)
+    normalized = pd.DataFrame([["1.00", "a"]], columns=df.columns)
+    expected = hashlib.sha256(normalized.to_csv(index=False).encode("utf-8")).hexdigest()
+    assert df_fingerprint(df, sort_rows=False)[0] == expected
+    assert df_fingerprint(df.iloc[:0], sort_rows=False)[0] == hashlib.sha256(
+        df.iloc[:0].to_csv(index=False).encode("utf-8")
+    ).hexdigest()
+
+
+@pytest.fixture
+def ordered():
+    return pd.DataFrame({"n": range(5000), "s": [f"row {i}" for i in range(5000)]})
+
+
+@pytest.mark.parametrize("sample_rows", [10, 2000, 4999])
+def test_sample_prefilter_uses_the_sample_size_of_the_expected_value(ordered, sample_rows):
+    v = make_df_validator_nospoilers(
+        df_fingerprint(ordered, sort_rows=False)[0],
+        sort_rows=False,
+        expected_sample_hash=df_sample_fingerprint(ordered, sample_rows=sample_rows),
+    )
+    assert v("", ordered.copy(), None) == (True, [""])
+    wrong = ordered.copy()
+    wrong.loc[len(wrong) - 1, "s"] = "changed"
+    assert v("", wrong, None)[0] is False
+
+
+def test_sample_hash_requires_size_prefix(ordered):
+    with pytest.raises(ValueError):
+        make_df_validator_nospoilers("00", sort_rows=False, expected_sample_hash="abcd")
+
+
+def test_cached_frame_skips_the_sample_pass(ordered, monkeypatch):
+    v = make_df_validator_nospoilers(
+        df_fingerprint(ordered, sort_rows=False)[0],
+        sort_rows=False,
+        expected_sample_hash=df_sample_fingerprint(ordered),
+    )
+    assert v("", ordered, None)[0]
+    calls = []
+    real = validators._sample_digest
+    monkeypatch.setattr(validators, "_sample_digest", lambda *a, **k: calls.append(1) or real(*a, **k))
+    assert v("", ordered, None)[0]
+    assert calls == []
+
+
+def test_fast_fingerprint_of_frames_without_columns():
+    three, four = pd.DataFrame(index=range(3)), pd.DataFrame(index=range(4))
+    assert df_fingerprint(three, fast=True)[0] == df_fingerprint(three.copy(), fast=True)[0]
+    assert df_fingerprint(three, fast=True)[0] != df_fingerprint(four, fast=True)[0]
+    assert df_fingerprint(pd.DataFrame(), fast=True)[0] != df_fingerprint(three, fast=True)[0]
+
+
+@pytest.mark.parametrize("algo", ["shake_128", "shake_256", "no_such_hash"])
+def test_unusable_hash_algo_fails_up_front(algo):
+    with pytest.raises(ValueError):
+        make_df_validator_nospoilers("00", hash_algo=algo)
+    with pytest.raises(ValueError):
+        df_fingerprint(EXPECTED, hash_algo=algo)
+
+
+@pytest.mark.parametrize("algo", ["sha256", "blake2b", "md5", "sha3_256"])
+def test_fixed_size_hash_algos_are_accepted(algo):
+    h, _ = df_fingerprint(EXPECTED, hash_algo=algo)
+    assert make_df_validator_nospoilers(h, hash_algo=algo)("", EXPECTED, None) == (True, [""])
+
+
+def _baseline_fingerprint(df, *, sort_rows=True, sort_cols=False, normalize_whitespace=True, na_token="<NA>"):
+    # the original normalize/sort/to_csv pipeline; df_fingerprint must stay byte-identical to it
+    x = df.copy()
+    if sort_cols:
+        x = x.reindex(sorted(x.columns), axis=1)
+
+    def norm(v):
+        if pd.isna(v):
+            return na_token
+        if isinstance(v, (float, int)) and not isinstance(v, bool):
+            return f"{float(v):.2f}"
+        s = str(v)
+        if normalize_whitespace:
+            s = " ".join(s.split())
+        return s
+
+    x = x.map(norm)
+    if sort_rows and len(x.columns) > 0 and len(x) > 0:
+        x = x.sort_values(by=list(x.columns), kind="mergesort").reset_index(drop=True)
+    else:
+        x = x.reset_index(drop=True)
+    return hashlib.sha256(x.to_csv(index=False).encode("utf-8")).hexdigest()
+
+
+REFERENCE_FRAMES = {
+    "ints": pd.DataFrame({"a": [3, 1, 2, 1], "b": [10, 20, 30, 40]}),
+    "floats": pd.DataFrame({"x": [1.005, np.nan, -0.0, 0.0, 2.675, np.inf, -np.inf, 1e20]}),
+    "float32": pd.DataFrame({"x": np.array([0.1, 0.7, np.nan], dtype=np.float32)}),
+    "bigint": pd.DataFrame({"x": np.array([2**62 + 1, -(2**62), 5], dtype=np.int64)}),
+    "nullable": pd.DataFrame({
+        "i": pd.array([1, None, 3], dtype="Int64"),
+        "f": pd.array([1.5, None, -0.0], dtype="Float64"),
+        "b": pd.array([True, None, False], dtype="boolean"),
+    }),
+    "str": pd.DataFrame({"s": ["  a  b ", "c,d", 'e"f', "g\nh", "", None, "ü  ñ"], "n": range(7)}),
+    "string_dtype": pd.DataFrame({"s": pd.array(["b", None, " a", "b"], dtype="string")}),
+    "object_str": pd.DataFrame({"s": pd.Series(["b", "a", None, " x "], dtype=object)}),
+    "mixed_object": pd.DataFrame({"m": pd.Series([1, 2.5, "x", None, True, np.int64(3)], dtype=object)}),
+    "bool": pd.DataFrame({"b": [True, False, True], "n": [2, 1, 2]}),
+    "datetime": pd.DataFrame({"d": pd.to_datetime(["2024-01-02", None, "2023-05-06"])}),
+    "duplicate_rows": pd.DataFrame({"a": [1, 1, 1, 2], "b": ["x", "x", "y", "x"]}),
+    "column_order": pd.DataFrame({"b,x": [1, 2], 'a"q': ["z", "y"], "COUNT(*)": [5, 4]}),
+    "empty": pd.DataFrame({"a": [], "b c": []}),
+    "no_columns": pd.DataFrame(index=range(3)),
+    "nothing": pd.DataFrame(),
+}
+
+OPTIONS = [
+    dict(sort_rows=sort_rows, sort_cols=sort_cols, normalize_whitespace=ws)
+    for sort_rows in (True, False) for sort_cols in (True, False) for ws in (True, False)
+]
+
+
+@pytest.mark.parametrize("options", OPTIONS, ids=lambda o: "-".join(k for k, v in o.items() if v) or "none")
+@pytest.mark.parametrize("name", list(REFERENCE_FRAMES))
+def test_fingerprint_matches_baseline(name, options):
+    df = REFERENCE_FRAMES[name]
+    before = df.copy()
+    assert df_fingerprint(df, **options)[0] == _baseline_fingerprint(df, **options)
+    assert df.equals(before)
+
+
+def _random_column(rng, n):
+    kind = rng.integers(7)
+    if kind == 0:
+        return rng.integers(-3, 4, n)
+    if kind == 1:
+        vals = rng.choice([0.0, -0.0, 0.005, 0.015, 1.125, 2.675, -1.5, 1e17, np.nan, np.inf], n)
+        return vals + rng.choice([0.0, 1e-9], n)
+    if kind == 2:
+        return pd.array(rng.choice([1, 2, None], n), dtype="Int64")
+    if kind == 3:
+        return rng.choice(["a", "b ", " a", "a  b", "", "x,y"], n)
+    if kind == 4:
+        return pd.Series(rng.choice(["a", None, " b"], n), dtype=object)
+    if kind == 5:
+        return rng.choice([True, False], n)
+    return pd.Series([[1, 2.5, "1.00", None, True, " z"][i] for i in rng.integers(6, size=n)], dtype=object)
+
+
+def test_fingerprint_matches_baseline_on_random_frames():
+    rng = np.random.default_rng(20240601)
+    for _ in range(300):
+        n = int(rng.integers(0, 12))
+        df = pd.DataFrame({f"c{rng.integers(9)}_{i}": _random_column(rng, n) for i in range(rng.integers(1, 5))})
+        options = OPTIONS[rng.integers(len(OPTIONS))]
+        assert df_fingerprint(df, **options)[0] == _baseline_fingerprint(df, **options), (df, options)
+
+
+def _baseline_rules(sql):
+    # the original per-token `in` checks
+    s = " ".join(sql.lower().split())
+    return {rule for rule, token in _PROCESS_RULE_TOKENS.items() if token in s}
+
+
+def _rules_found(sql):
+    return {rule for rule in _PROCESS_RULE_TOKENS if check_process_rules(sql, require=[rule])[0]}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT a FROM t havingroup by a",
+    "select * from t where x in (select y from u) order by 1 limit 5",
+    "SELECT DISTINCT a FROM t\n  JOIN\tu ON t.a = u.a GROUP   BY a HAVING count(*) > 1",
+    "select * from t join(select 1) x",
+    "SELECT wherever, limits, orderly FROM t",
+    "select 'order by' from t",
+    "",
+])
+def test_process_rules_match_the_in_checks(sql):
+    assert _rules_found(sql) == _baseline_rules(sql)
+
+
+def test_process_rules_match_the_in_checks_on_random_sql():
+    rng = np.random.default_rng(7)
+    words = list(_PROCESS_RULE_TOKENS.values()) + ["select", "a", "(", " ", "\n", "by", "group", "ing", "hav", "x"]
+    for _ in range(2000):
+        sql = "".join(rng.choice(words, int(rng.integers(0, 10))))
+        assert _rules_found(sql) == _baseline_rules(sql), sql
+
+
+def test_process_rules_report_the_first_failing_rule():
+    assert check_process_rules("SELECT a FROM t ORDER BY a", require=["where"], forbid=["order_by"]) == (
+        False, ["Use a WHERE clause."]
+    )
+    assert check_process_rules("SELECT a FROM t WHERE a ORDER BY a", require=["where"], forbid=["order_by"]) == (
+        False, ["Don’t use ORDER BY for this exercise."]
+    )
+    assert check_process_rules("SELECT 1", require=["nope"])[0] is False
+
+
+def test_validator_pickles_its_config_but_not_its_cache(ordered):
+    v = make_df_validator_nospoilers(
+        df_fingerprint(ordered, sort_rows=False, hash_algo="blake2b")[0],
+        required_cols=["n", "s"],
+        expected_rows=len(ordered),
+        sort_rows=False,
+        hash_algo="blake2b",
+        expected_sample_hash=df_sample_fingerprint(ordered, sample_rows=100, hash_algo="blake2b"),
+    )
+    assert v("", ordered, None) == (True, [""])
+    assert len(v.fp_cache) == 1
+
+    clone = pickle.loads(pickle.dumps(v))
+    assert all(getattr(clone, f.name) == getattr(v, f.name) for f in fields(v) if f.init)
+    assert len(clone.fp_cache) == 0
+    assert clone("", ordered, None) == (True, [""])
+    assert clone("", ordered.head(10), None)[0] is False